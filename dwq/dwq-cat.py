@@ -3,6 +3,7 @@ import json
 import sys
 
 from dwq import Job, Disque
+import dwq.util as util
 
 
 def main():
@@ -11,9 +12,9 @@ def main():
     queues = sys.argv[1] or "default"
     try:
         while True:
-            jobs = Job.wait(queues, count=16)
+            jobs = Job.wait(queues, count=16, allow_json=True)
             for job in jobs:
-                print(json.dumps(job, sort_keys=True, indent=4))
+                print(json.dumps(job, sort_keys=True, indent=4, default=util.json_default))
     except KeyboardInterrupt:
         pass
 
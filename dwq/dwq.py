@@ -1,8 +1,62 @@
 import json
-from pydisque.client import Client
+
+import msgspec
+from pydisque.client import Client, retry
+from redis.exceptions import ConnectionError
+
+import dwq.util as util
 
 disque = None
 
+_enc = msgspec.msgpack.Encoder()
+_dec = msgspec.msgpack.Decoder()
+
+
+def _decode(data, allow_json=False):
+    # job bodies are msgpack encoded. report queues contain JSON, which is not
+    # valid msgpack, so with allow_json, fall back to parsing that.
+    try:
+        return _dec.decode(data)
+    except msgspec.DecodeError as e:
+        if not allow_json:
+            raise
+
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise e from None
+
+
+class _PipelineClient(object):
+    # stands in for a pydisque Client, so Client methods (e.g., add_job()) can
+    # be used to queue their commands on a redis pipeline.
+    def __init__(s, pipe):
+        s.pipe = pipe
+
+    def execute_command(s, *args, **kwargs):
+        s.pipe.execute_command(*args, **kwargs)
+
+
+@retry()
+def _add_jobs_pipelined(jobs):
+    # same retry and reconnect behavior as pydisque's Client.execute_command()
+    try:
+        pipe = disque.get_connection().pipeline(transaction=False)
+        pipe_client = _PipelineClient(pipe)
+        for queue, body, kwargs in jobs:
+            Client.add_job(pipe_client, queue, body, **kwargs)
+
+        results = pipe.execute(raise_on_error=False)
+    except ConnectionError:
+        disque.connect()
+        raise
+
+    # retry jobs that got an error reply one by one
+    return [
+        disque.add_job(queue, body, **kwargs) if isinstance(result, Exception) else result
+        for (queue, body, kwargs), result in zip(jobs, results)
+    ]
+
 
 class Disque(object):
     def connect(servers):
@@ -66,7 +120,7 @@ class Job(object):
         s.queue_name = queue_name
         s.nacks = nacks
         s.additional_deliveries = additional_deliveries
-        s.control_queues = body.get("control_queues") or []
+        s.control_queues = body.get("control_queues") or ()
 
     def get(queues, timeout=None, count=None, nohang=False):
         global disque
@@ -74,10 +128,9 @@ class Job(object):
         _jobs = disque.get_job(
             queues, timeout=timeout, count=count, nohang=nohang, withcounters=True
         )
+        # queue_name and job_id are kept as bytes
         for queue_name, job_id, json_body, nacks, additional_deliveries in _jobs:
-            queue_name = queue_name.decode("ascii")
-            job_id = job_id.decode("ascii")
-            body = json.loads(json_body.decode("utf-8"))
+            body = _decode(json_body)
             jobs.append(Job(job_id, body, queue_name, nacks, additional_deliveries))
 
         return jobs
@@ -93,17 +146,41 @@ class Job(object):
                     queue = s.job_id
                 disque.add_job(
                     queue,
-                    json.dumps({"job_id": s.job_id, "state": "done", "result": result}),
+                    _enc.encode({"job_id": s.job_id, "state": "done", "result": result}),
                 )
 
         disque.ack_job(s.job_id)
 
-    def add(queue, body, control_queues=None, **kwargs):
+    def add(queue, body, control_queues=None, as_json=False, **kwargs):
         if control_queues:
             body["control_queues"] = control_queues
 
-        json_body = json.dumps(body)
-        return disque.add_job(queue, json_body, **kwargs).decode("ascii")
+        # as_json is meant for queues read by external consumers (e.g., reports)
+        if as_json:
+            _body = json.dumps(body, default=util.json_default)
+        else:
+            _body = _enc.encode(body)
+
+        return disque.add_job(queue, _body, **kwargs)
+
+    def add_many(jobs, control_queues=None, chunk_size=1000):
+        # "jobs" is a list of (queue, body, kwargs) tuples, kwargs are passed
+        # to add_job(). The ADDJOB commands are pipelined, needing one
+        # round-trip per chunk_size jobs. Returns the list of job ids.
+        # Like add_job(), a chunk is retried after connection errors, so jobs
+        # of a partially sent chunk might get queued twice.
+        job_ids = []
+        for i in range(0, len(jobs), chunk_size):
+            chunk = []
+            for queue, body, kwargs in jobs[i : i + chunk_size]:
+                if control_queues:
+                    body["control_queues"] = control_queues
+
+                chunk.append((queue, _enc.encode(body), kwargs))
+
+            job_ids.extend(_add_jobs_pipelined(chunk))
+
+        return job_ids
 
     def nack(s):
         disque.nack_job(s.job_id)
@@ -111,15 +188,18 @@ class Job(object):
     def cancel(s):
         disque.del_job(s.job_id)
 
-    def wait(queue, count=None):
+    def wait(queue, count=None, allow_json=False):
         _jobs = disque.get_job([queue], count=count)
         jobs = []
+        job_ids = []
         for queue_name, job_id, json_body in _jobs:
-            queue_name = queue_name.decode("ascii")
-            job_id = job_id.decode("ascii")
-            body = json.loads(json_body.decode("utf-8"))
-            disque.fast_ack(job_id)
+            body = _decode(json_body, allow_json)
+            job_ids.append(job_id)
             jobs.append(body)
+
+        if job_ids:
+            disque.fast_ack(*job_ids)
+
         return jobs
 
     def cancel_all(job_ids):
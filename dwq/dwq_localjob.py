@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 
-import json
-import random
 import os
 import signal
 import sys
@@ -69,7 +67,7 @@ def main():
         sys.exit(1)
 
     try:
-        parent_jobid = os.environ["DWQ_JOBID"]
+        parent_jobid = os.environ["DWQ_JOBID"].encode("ascii")
     except KeyError:
         print("dwqc: error: DWQ_JOBID unset.")
         sys.exit(1)
@@ -78,7 +76,7 @@ def main():
     signal.signal(signal.SIGTERM, sigterm_handler)
     Disque.connect([args.disque_url])
 
-    unique = random.random()
+    unique = util.unique_id()
 
     job_command = shlex.join(args.command)
 
@@ -95,15 +93,14 @@ def main():
         "body": {
             "command": args.command_override or job_command,
         },
-        "unique": str(unique),
+        "unique": unique,
         "times": {
             "cmd_runtime": cmd_runtime,
         },
     }
 
     # let controller know there's a job result incoming
-    job_id = "localjob-" + str(unique)
-    disque = Disque.get()
+    job_id = "localjob-" + unique
     body = {
         "parent": parent_jobid,
         "subjob": job_id,
@@ -112,7 +109,4 @@ def main():
     Job.add(control_queue, body, None)
 
     # send actual job result
-    disque.add_job(
-        control_queue,
-        json.dumps({"job_id": job_id, "state": "done", "result": result_body}),
-    )
+    Job.add(control_queue, {"job_id": job_id, "state": "done", "result": result_body})
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
 import json
-import random
+import re
 import os
 import signal
 import sys
 import time
 import argparse
 
+import msgspec
+
 from dwq import Job, Disque
 import dwq.util as util
 
@@ -19,26 +21,67 @@ def sigterm_handler(signal, stack_frame):
 
 
 def nicetime(time):
-    secs = round(time)
-    minutes = secs / 60
-    hrs = minutes / 60
-    days = int(hrs / 24)
-    secs = int(secs % 60)
-    minutes = int(minutes % 60)
-    hrs = int(hrs % 24)
-    res = ""
+    minutes, secs = divmod(int(round(time)), 60)
+    hrs, minutes = divmod(minutes, 60)
+    days, hrs = divmod(hrs, 24)
+    parts = []
     if days:
-        res += "%id:" % days
+        parts.append(f"{days}d")
     if hrs:
-        res += "%ih:" % hrs
+        parts.append(f"{hrs}h")
     if minutes:
-        if hrs and minutes < 10:
-            res += "0"
-        res += "%im:" % minutes
-    if minutes and secs < 10:
-        res += "0"
-    res += "%is" % secs
-    return res
+        parts.append(f"{minutes:02d}m" if hrs else f"{minutes}m")
+    parts.append(f"{secs:02d}s" if minutes else f"{secs}s")
+    return ":".join(parts)
+
+
+class RateLimit(object):
+    # returns True at most once per interval (in seconds), or if forced
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if force or self.last is None or now - self.last >= self.interval:
+            self.last = now
+            return True
+        return False
+
+
+class JsonListWriter(object):
+    # writes objects to a file as elements of a JSON list, one by one,
+    # so they don't need to be kept in memory.
+    def __init__(self, f):
+        self.f = f
+        self.sep = "["
+        self.closed = False
+
+    def write(self, obj):
+        self.f.write(self.sep)
+        self.f.write(json.dumps(obj, default=util.json_default))
+        self.sep = ","
+
+    def close(self):
+        if not self.closed:
+            self.f.write("[]" if self.sep == "[" else "]")
+            self.closed = True
+
+
+# minimum time between progress output updates
+PROGRESS_INTERVAL = 0.1
+
+# minimum time between "working" status reports
+REPORT_INTERVAL = 0.5
+
+
+# (option, environment variable, default) for options defaulting to the environment
+ENV_DEFAULTS = (
+    ("queue", "DWQ_QUEUE", "default"),
+    ("repo", "DWQ_REPO", None),
+    ("commit", "DWQ_COMMIT", None),
+    ("disque_url", "DWQ_DISQUE_URL", "localhost:7711"),
+)
 
 
 def parse_args():
@@ -51,7 +94,6 @@ def parse_args():
         "--queue",
         type=str,
         help='queue name for jobs (default: "default")',
-        default=os.environ.get("DWQ_QUEUE") or "default",
     )
 
     parser.add_argument(
@@ -59,7 +101,6 @@ def parse_args():
         "--repo",
         help="git repository to work on",
         type=str,
-        default=os.environ.get("DWQ_REPO"),
     )
 
     parser.add_argument(
@@ -67,7 +108,6 @@ def parse_args():
         "--commit",
         help="git commit to work on",
         type=str,
-        default=os.environ.get("DWQ_COMMIT"),
     )
 
     parser.add_argument(
@@ -151,7 +191,7 @@ def parse_args():
 
     parser.add_argument(
         "-D", "--disque-url", help="specify disque instance [default: localhost:7711]",
-        type=str, action="store", default=os.environ.get("DWQ_DISQUE_URL", "localhost:7711"),
+        type=str, action="store",
     )
 
     parser.add_argument(
@@ -160,7 +200,52 @@ def parse_args():
 
     parser.add_argument("command", type=str, nargs="?")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    # only fall back to the environment for options that were not given
+    for dest, var, default in ENV_DEFAULTS:
+        if getattr(args, dest) is None:
+            setattr(args, dest, os.environ.get(var) or default)
+
+    return args
+
+
+_options_decoder = msgspec.json.Decoder(dict)
+
+_placeholder_re = re.compile(r"\$\{(\d+)\}")
+
+
+# replace "${0}" with line and "${n}" with the n'th space separated word of line.
+# placeholders without matching word are left untouched.
+def substitute_placeholders(command, line):
+    subs = {str(i): word for i, word in enumerate(line.split(" "), 1)}
+    subs["0"] = line
+    return _placeholder_re.sub(lambda m: subs.get(m.group(1), m.group(0)), command)
+
+
+# yields the lines read from binary stream "raw", stripped of trailing whitespace.
+# reads in large chunks, which is a lot faster than iterating a text stream.
+def read_lines(raw, chunk_size=65536):
+    # pieces of a line spanning multiple chunks, joined once its newline
+    # arrives, so long lines don't get copied for every chunk.
+    rest = []
+    for chunk in iter(lambda: raw.read1(chunk_size), b""):
+        lines = chunk.split(b"\n")
+        if len(lines) == 1:
+            rest.append(chunk)
+            continue
+
+        if rest:
+            rest.append(lines[0])
+            lines[0] = b"".join(rest)
+
+        rest = [lines.pop()]
+        for line in lines:
+            yield line.rstrip().decode("utf-8", "replace")
+
+    rest = b"".join(rest)
+    if rest:
+        yield rest.rstrip().decode("utf-8", "replace")
 
 
 def get_env(env):
@@ -197,7 +282,7 @@ def create_body(args, command, options=None, parent_id=None):
     if args.env:
         env.update(get_env(args.env))
 
-    env.update(options.get("env", {}))
+    env.update(options.get("env", util.EMPTY_DICT))
     if env:
         body["env"] = env
 
@@ -205,7 +290,7 @@ def create_body(args, command, options=None, parent_id=None):
 
 
 def queue_job(jobs_set, queue, body, control_queues):
-    timeout = body.get("options", {}).get("timeout")
+    timeout = body.get("options", util.EMPTY_DICT).get("timeout")
     if timeout:
         job_id = Job.add(queue, body, control_queues, retry=timeout)
     else:
@@ -226,6 +311,45 @@ def queue_job(jobs_set, queue, body, control_queues):
     return job_id
 
 
+def queue_jobs(jobs_set, batch, control_queues):
+    # like queue_job(), but sends all (queue, body) tuples in "batch" at once
+    add_jobs = []
+    for queue, body in batch:
+        timeout = body.get("options", util.EMPTY_DICT).get("timeout")
+        add_jobs.append((queue, body, {"retry": timeout} if timeout else {}))
+
+    job_ids = Job.add_many(add_jobs, control_queues)
+
+    subjob_notifications = []
+    for (queue, body), job_id in zip(batch, job_ids):
+        parent = body.get("parent")
+        if parent:
+            subjob_notifications.append(
+                (
+                    control_queues[0],
+                    {
+                        "parent": parent,
+                        "subjob": job_id,
+                        "unique": os.environ.get("DWQ_JOB_UNIQUE"),
+                    },
+                    {},
+                )
+            )
+        else:
+            jobs_set.add(job_id)
+
+    if subjob_notifications:
+        Job.add_many(subjob_notifications)
+
+    return job_ids
+
+
+def print_read_progress(args, elapsed, jobs_read):
+    if not args.batch:
+        print("")
+    print(f"\033[F\033[K[{nicetime(elapsed)}] {jobs_read} jobs read", end="\r")
+
+
 def vprint(*args, **kwargs):
     global verbose
     if verbose:
@@ -236,19 +360,11 @@ verbose = False
 
 
 def dict_addset(_dict, key, data):
-    try:
-        _dict[key].add(data)
-    except KeyError:
-        _dict[key] = {data}
+    _dict.setdefault(key, set()).add(data)
 
 
 def dict_dictadd(_dict, key):
-    try:
-        return _dict[key]
-    except KeyError:
-        _tmp = {}
-        _dict[key] = _tmp
-        return _tmp
+    return _dict.setdefault(key, {})
 
 
 def handle_assets(job, args):
@@ -265,14 +381,14 @@ def handle_assets(job, args):
                 local = os.path.abspath(os.path.join(asset_dir, remote))
                 if not local.startswith(asset_dir):
                     print(
-                        'dwqc: warning: asset "%s" is not relative'
-                        ' to "%s", ignoring' % (remote, asset_dir), local,
+                        f'dwqc: warning: asset "{remote}" is not relative'
+                        f' to "{asset_dir}", ignoring', local,
                         file=sys.stderr,
                     )
                     continue
             else:
                 print(
-                    'dwqc: warning: ignoring asset "%s"' % remote, file=sys.stderr
+                    f'dwqc: warning: ignoring asset "{remote}"', file=sys.stderr
                 )
                 continue
 
@@ -301,22 +417,24 @@ def main():
             sys.exit(1)
 
         try:
-            parent_jobid = os.environ["DWQ_JOBID"]
+            parent_jobid = os.environ["DWQ_JOBID"].encode("ascii")
         except KeyError:
             print("dwqc: error: --subjob specified, but DWQ_JOBID unset.")
             sys.exit(1)
 
     else:
-        control_queue = "control::%s" % random.random()
+        control_queue = f"control::{util.unique_id()}"
         parent_jobid = None
 
     verbose = args.verbose
 
     if args.progress or args.report:
         start_time = time.time()
+        progress_limit = RateLimit(PROGRESS_INTERVAL)
+        report_limit = RateLimit(REPORT_INTERVAL)
 
     if args.report:
-        Job.add(args.report, {"status": "collecting jobs"})
+        Job.add(args.report, {"status": "collecting jobs"}, as_json=True)
 
     try:
         file_data = util.gen_file_data(args.file)
@@ -343,7 +461,7 @@ def main():
 
         base_options["timeout"] = args.timeout
 
-    result_list = []
+    result_writer = JsonListWriter(args.outfile) if args.outfile else None
     try:
         jobs = set()
         batch = []
@@ -358,26 +476,21 @@ def main():
         else:
             jobs_read = 0
             vprint("dwqc: reading jobs from stdin")
-            for line in sys.stdin:
-                line = line.rstrip()
+            for line in read_lines(sys.stdin.buffer):
                 if args.stdin and args.command:
-                    cmdargs = line.split(" ")
-                    command = args.command
-                    for i in range(0, len(cmdargs)):
-                        command = command.replace("${%i}" % (i + 1), cmdargs[i])
-                    command = command.replace("${0}", line)
+                    command = substitute_placeholders(args.command, line)
                 else:
                     command = line
 
                 tmp = command.split("###")
                 command = tmp[0]
-                options = {}
-                options.update(base_options)
+                # base_options is shared by all jobs without per-job options
+                options = base_options
                 if len(tmp) > 1:
                     command = command.rstrip()
                     try:
-                        options.update(json.loads(tmp[1]))
-                    except json.decoder.JSONDecodeError:
+                        options = {**base_options, **_options_decoder.decode(tmp[1])}
+                    except msgspec.DecodeError:
                         vprint(
                             "dwqc: invalid option JSON. Skipping job.", file=sys.stderr
                         )
@@ -390,7 +503,6 @@ def main():
                         (
                             _job_queue,
                             create_body(args, command, options, parent_jobid),
-                            [control_queue],
                         )
                     )
                 else:
@@ -401,43 +513,40 @@ def main():
                         [control_queue],
                     )
                     vprint(
-                        'dwqc: job %s command="%s" sent to queue %s.'
-                        % (job_id, command, _job_queue)
+                        f'dwqc: job {job_id.decode()} command="{command}"'
+                        f" sent to queue {_job_queue}."
                     )
-                    if args.progress:
-                        print("")
 
                 if args.progress or args.report:
                     jobs_read += 1
-                    elapsed = time.time() - start_time
 
-                    if args.progress:
-                        print(
-                            "\033[F\033[K[%s] %s jobs read"
-                            % (nicetime(elapsed), jobs_read),
-                            end="\r",
-                        )
+                    # verbose output overwrites the progress line, so always redraw
+                    if args.progress and progress_limit(force=verbose):
+                        print_read_progress(args, time.time() - start_time, jobs_read)
 
                     # if args.report:
                     #    Job.add(args.report, { "status" : "collecting jobs", "total" : jobs_read })
 
+            # make sure the final count is shown
+            if args.progress:
+                print_read_progress(args, time.time() - start_time, jobs_read)
+
         _time = ""
-        if args.batch and args.stdin:
+        if batch:
             before = time.time()
             vprint("dwqc: sending jobs")
-            for _tuple in batch:
-                queue_job(jobs, *_tuple)
-            _time = "(took %s)" % nicetime(time.time() - before)
+            queue_jobs(jobs, batch, [control_queue])
+            _time = f"(took {nicetime(time.time() - before)})"
 
             if args.report:
-                Job.add(args.report, {"status": "sending jobs"})
+                Job.add(args.report, {"status": "sending jobs"}, as_json=True)
 
         if args.stdin:
             vprint("dwqc: all jobs sent.", _time)
 
         if args.subjob:
             if args.report:
-                Job.add(args.report, {"status": "done"})
+                Job.add(args.report, {"status": "done"}, as_json=True)
             return
 
         if args.progress:
@@ -470,15 +579,18 @@ def main():
                         job_id = job["job_id"]
                         jobs.remove(job_id)
                         done += 1
-                        _has_passed = job["result"]["status"] in {0, "0", "pass"}
+                        _has_passed = job["result"]["status"] in util.PASS_STATUSES
                         # if args.progress:
                         #    vprint("\033[F\033[K", end="")
                         # vprint("dwqc: job %s done. result=%s" % (job["job_id"], job["result"]["status"]))
-                        if not args.quiet:
+                        _output = job["result"].get("output")
+                        _printed = False
+                        if not args.quiet and _output:
                             if _has_passed or (not args.no_error_output):
                                 if args.progress:
                                     print("\033[K", end="")
-                                print(job["result"]["output"], end="")
+                                print(_output, end="")
+                                _printed = True
 
                         handle_assets(job, args)
 
@@ -492,12 +604,12 @@ def main():
                             except KeyError:
                                 pass
 
-                        if args.outfile:
-                            result_list.append(job)
+                        if result_writer:
+                            result_writer.write(job)
 
                         # collect subjobs started by this job instance, add to waitlist
                         unique = job["result"]["unique"]
-                        _subjobs = subjobs.get(job_id, {}).get(unique, [])
+                        _subjobs = subjobs.get(job_id, util.EMPTY_DICT).get(unique, ())
                         for subjob_id in _subjobs:
                             try:
                                 early_subjobs.append(unexpected.pop(subjob_id))
@@ -508,21 +620,30 @@ def main():
 
                         total += len(_subjobs)
 
-                        if args.progress or args.report:
+                        # job output overwrites the progress line, so redraw it.
+                        # always report failed jobs, and make sure the final
+                        # state gets printed / reported.
+                        _progress = args.progress and progress_limit(
+                            force=_printed or not jobs
+                        )
+                        _report = args.report and report_limit(
+                            force=not _has_passed or not jobs
+                        )
+
+                        if _progress or _report:
                             elapsed = time.time() - start_time
                             per_job = elapsed / done
-                            eta = (total - done) * per_job
+                            eta = len(jobs) * per_job
 
-                            if args.progress:
+                            if _progress:
                                 print(
-                                    "\r\033[K[%s] %s/%s jobs done (%s passed, %s failed.) "
-                                    "ETA:"
-                                    % (nicetime(elapsed), done, total, passed, failed),
+                                    f"\r\033[K[{nicetime(elapsed)}] {done}/{total} jobs done "
+                                    f"({passed} passed, {failed} failed.) ETA:",
                                     nicetime(eta),
                                     end="\r",
                                 )
 
-                            if args.report:
+                            if _report:
                                 Job.add(
                                     args.report,
                                     {
@@ -534,22 +655,22 @@ def main():
                                         "failed": failed,
                                         "job": job,
                                     },
+                                    as_json=True,
                                 )
 
                         if not _has_passed:
                             if failed >= failed_expected:
                                 if (failed - failed_expected) > args.maxfail:
                                     print(
-                                        "dwqc: more than %i jobs failed. Exiting."
-                                        % args.maxfail,
+                                        f"dwqc: more than {args.maxfail} jobs failed. Exiting.",
                                         file=sys.stderr,
                                     )
                                     sys.exit(1)
                     except KeyError:
                         unexpected[job_id] = job
 
-        if args.outfile:
-            args.outfile.write(json.dumps(result_list))
+        if result_writer:
+            result_writer.close()
 
         if args.progress:
             print("")
@@ -558,16 +679,15 @@ def main():
         print("dwqc: cancelling...")
         Job.cancel_all(jobs)
         if args.report:
-            Job.add(args.report, {"status": "canceled"})
+            Job.add(args.report, {"status": "canceled"}, as_json=True)
 
-        if args.outfile:
-            args.outfile.seek(0)
-            args.outfile.write(json.dumps(result_list))
+        if result_writer:
+            result_writer.close()
 
         sys.exit(1)
 
     if args.report:
-        Job.add(args.report, {"status": "done"})
+        Job.add(args.report, {"status": "done"}, as_json=True)
 
     if failed > failed_expected:
         sys.exit(1)
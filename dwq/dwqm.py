@@ -2,10 +2,10 @@
 
 import argparse
 import os
-import random
 import sys
 
 from dwq import Job, Disque
+import dwq.util as util
 from dwq.version import __version__
 
 
@@ -70,7 +70,7 @@ def listq(args):
             queue = qstat[name]
             print_queue(name, queue)
         except KeyError:
-            print('invalid queue "%s"' % name)
+            print(f'invalid queue "{name}"')
 
 
 def drain(args):
@@ -140,10 +140,10 @@ def list_nodes():
 
 
 def control_cmd(nodes, cmd, **kwargs):
-    control_queue = "control::%s" % str(random.random())
+    control_queue = f"control::{util.unique_id()}"
     job_ids = []
     for node in nodes:
-        print('dwqm: sending "%s" command to node "%s"' % (cmd, node))
+        print(f'dwqm: sending "{cmd}" command to node "{node}"')
         job_id = control_send_cmd(node, cmd, control_queue, **kwargs)
         job_ids.append(job_id)
 
@@ -152,7 +152,7 @@ def control_cmd(nodes, cmd, **kwargs):
             job_id = job["job_id"]
             job_ids.remove(job_id)
             try:
-                print("%s:" % job["result"]["worker"], job["result"].get("output"))
+                print(f'{job["result"]["worker"]}:', job["result"].get("output"))
             except KeyError:
                 pass
 
@@ -162,7 +162,7 @@ def control_send_cmd(worker_name, cmd, control_queue, **kwargs):
     if kwargs:
         body["control"]["args"] = kwargs
 
-    job_id = Job.add("control::worker::%s" % worker_name, body, [control_queue])
+    job_id = Job.add(f"control::worker::{worker_name}", body, [control_queue])
     return job_id
 
 
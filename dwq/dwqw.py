@@ -2,15 +2,22 @@
 
 import argparse
 import os
+import re
 import threading
-import random
 import time
 import signal
 import socket
 import traceback
 import multiprocessing
 import shutil
-from subprocess import run, PIPE, STDOUT, TimeoutExpired, CalledProcessError
+from subprocess import (
+    CompletedProcess,
+    Popen,
+    PIPE,
+    STDOUT,
+    TimeoutExpired,
+    CalledProcessError,
+)
 
 import redis
 from redis.exceptions import ConnectionError, RedisError
@@ -80,10 +87,83 @@ def parse_args():
     return parser.parse_args()
 
 
+# characters with special meaning to the shell, control characters, and any
+# whitespace other than space and tab (which sh would keep within a word)
+_shell_chars_re = re.compile(
+    r"[|&;<>()$`\\\"'*?\[\]#~{}!\x00-\x08\x0a-\x1f\x7f]|[^\S \t]"
+)
+
+_split_re = re.compile(r"[ \t]+")
+
+# shell keywords and builtins, which cannot be executed directly or
+# behave differently than the binaries of the same name (e.g., "echo -e")
+_shell_words = frozenset(
+    {
+        ".", ":", "[", "[[", "alias", "bg", "break", "case", "cd", "command",
+        "continue", "do", "done", "echo", "elif", "else", "esac", "eval",
+        "exec", "exit", "export", "false", "fc", "fg", "fi", "for",
+        "function", "getopts", "hash", "if", "in", "jobs", "kill", "local",
+        "printf", "pwd", "read", "readonly", "return", "select", "set",
+        "shift", "source", "test", "then", "time", "times", "trap", "true",
+        "type", "ulimit", "umask", "unalias", "unset", "until", "wait",
+        "while",
+    }
+)
+
+
+def split_command(command):
+    # returns command's argument list if it can be executed without a
+    # shell, None otherwise. this saves starting /bin/sh for simple commands.
+    if _shell_chars_re.search(command):
+        return None
+
+    args = _split_re.split(command.strip(" \t"))
+    if not args[0] or "=" in args[0] or args[0] in _shell_words:
+        return None
+
+    return args
+
+
+def run_command(command, timeout=None, **kwargs):
+    # like run(command, shell=True, ...), but skips the shell if possible
+    process = None
+    cmd_args = split_command(command)
+    if cmd_args:
+        try:
+            process = Popen(cmd_args, **kwargs)
+        except OSError:
+            # let the shell handle errors like "not found" or missing shebang
+            pass
+
+    if process is None:
+        process = Popen(command, shell=True, **kwargs)
+
+    # same as run()
+    with process:
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except TimeoutExpired as e:
+            process.kill()
+            e.stdout, e.stderr = process.communicate()
+            raise
+        except:
+            process.kill()
+            raise
+
+    return CompletedProcess(process.args, process.poll(), stdout, stderr)
+
+
 shutdown = False
 
+# snapshot of the environment at startup, used as base for all job environments
+base_env = {}
+
 active_event = threading.Event()
 
+# notified by the main thread after (re-)connecting. workers wait on this
+# while the connection is down.
+connected_cond = threading.Condition()
+
 
 def worker(n, cmd_server_pool, gitjobdir, args, working_set):
     global active_event
@@ -95,7 +175,11 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
     while not shutdown:
         try:
             if not shutdown and not Disque.connected():
-                time.sleep(1)
+                # the short timeout covers reconnects done by pydisque itself
+                # within another worker thread, which don't notify.
+                with connected_cond:
+                    if not Disque.connected():
+                        connected_cond.wait(timeout=1)
                 continue
             while not shutdown:
                 active_event.wait()
@@ -119,36 +203,31 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
                         )
                         continue
 
+                    body = job.body
                     buildnum += 1
                     working_set.add(job.job_id)
                     before = time.time()
                     vprint(
                         2,
-                        f"{worker_str}: got job {job.job_id} from queue {job.queue_name}",
+                        f"{worker_str}: got job {job.job_id.decode()} from queue {job.queue_name.decode()}",
                     )
 
                     try:
-                        command = job.body["command"]
+                        command = body["command"]
                     except KeyError:
                         vprint(2, f"{worker_str}: invalid job json body")
                         job.done(
                             {
                                 "status": "error",
-                                "output": f'{worker_str} invalid job body: "{job.body}"',
+                                "output": f'{worker_str} invalid job body: "{body}"',
                             }
                         )
                         continue
 
                     vprint(2, f'{worker_str}: command="{command}"')
 
-                    repo = None
-                    commit = None
-
-                    try:
-                        repo = job.body["repo"]
-                        commit = job.body["commit"]
-                    except KeyError:
-                        pass
+                    repo = body.get("repo")
+                    commit = body.get("commit")
 
                     if (repo is None) ^ (commit is None):
                         vprint(
@@ -158,39 +237,31 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
                         job.done(
                             {
                                 "status": "error",
-                                "output": f'{worker_str} invalid job body: "{job.body}"',
+                                "output": f'{worker_str} invalid job body: "{body}"',
                             }
                         )
                         continue
 
-                    exclusive = None
-                    try:
-                        options = job.body.get("options") or {}
-                        if options.get("jobdir") or "" == "exclusive":
-                            exclusive = str(random.random())
-                    except KeyError:
-                        pass
-
-                    unique = random.random()
+                    options = body.get("options") or util.EMPTY_DICT
+                    max_retries = options.get("max_retries", 2)
 
-                    _env = os.environ.copy()
-
-                    try:
-                        _env.update(job.body["env"])
-                    except KeyError:
-                        pass
-
-                    _env.update(
-                        {
-                            "DWQ_QUEUE": job.queue_name,
-                            "DWQ_WORKER": args.name,
-                            "DWQ_WORKER_BUILDNUM": str(buildnum),
-                            "DWQ_WORKER_THREAD": str(n),
-                            "DWQ_JOBID": job.job_id,
-                            "DWQ_JOB_UNIQUE": str(unique),
-                            "DWQ_CONTROL_QUEUE": job.body.get("control_queues")[0],
-                        }
-                    )
+                    exclusive = None
+                    if options.get("jobdir") == "exclusive":
+                        exclusive = util.unique_id()
+
+                    unique = util.unique_id()
+
+                    _env = {
+                        **base_env,
+                        **body.get("env", util.EMPTY_DICT),
+                        "DWQ_QUEUE": job.queue_name.decode("ascii"),
+                        "DWQ_WORKER": args.name,
+                        "DWQ_WORKER_BUILDNUM": str(buildnum),
+                        "DWQ_WORKER_THREAD": str(n),
+                        "DWQ_JOBID": job.job_id.decode("ascii"),
+                        "DWQ_JOB_UNIQUE": unique,
+                        "DWQ_CONTROL_QUEUE": body["control_queues"][0],
+                    }
 
                     workdir = None
                     workdir_output = None
@@ -215,7 +286,7 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
                                 )
 
                             if not workdir:
-                                if job.nacks < options.get("max_retries", 2):
+                                if job.nacks < max_retries:
                                     job.nack()
                                     vprint(
                                         1,
@@ -234,7 +305,7 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
                                             or f"{worker_str}: error getting jobdir\n",
                                             "worker": args.name,
                                             "runtime": 0,
-                                            "body": job.body,
+                                            "body": body,
                                         }
                                     )
                                     vprint(
@@ -253,9 +324,10 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
 
                         # assets
                         asset_dir = os.path.join(
-                            workdir, "assets", "%s:%s" % (hash(job.job_id), str(unique))
+                            workdir, "assets", f"{hash(job.job_id)}:{unique}"
                         )
-                        _env.update({"DWQ_ASSETS": asset_dir})
+                        # PWD is also set by the shell, but not if it is skipped
+                        _env.update({"DWQ_ASSETS": asset_dir, "PWD": workdir})
 
                         timeout = options.get("timeout", 300)
 
@@ -270,13 +342,12 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
 
                         if timeout > 0:
                             try:
-                                res = run(
+                                res = run_command(
                                     command,
-                                    stdout=PIPE,
-                                    stderr=STDOUT,
                                     cwd=workdir,
-                                    shell=True,
                                     env=_env,
+                                    stdout=PIPE,
+                                    stderr=STDOUT,
                                     start_new_session=True,
                                     timeout=timeout,
                                 )
@@ -295,9 +366,7 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
 
                         command_done_at = time.time()
 
-                        if (result not in {0, "0", "pass"}) and job.nacks < options.get(
-                            "max_retries", 2
-                        ):
+                        if (result not in util.PASS_STATUSES) and job.nacks < max_retries:
                             vprint(
                                 2,
                                 f"{worker_str}: command:",
@@ -314,20 +383,19 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
                             workdir_setup_time = workdir_done_at - before
                             write_files_time = write_files_done_at - workdir_done_at
 
-                            options = job.body.get("options")
                             if options:
                                 options.pop("files", None)
 
                             # remove options from body if it is now empty
                             if not options:
-                                job.body.pop("options", None)
+                                body.pop("options", None)
 
                             _result = {
                                 "status": result,
                                 "output": output,
                                 "worker": args.name,
-                                "body": job.body,
-                                "unique": str(unique),
+                                "body": body,
+                                "unique": unique,
                                 "times": {
                                     "cmd_runtime": cmd_runtime,
                                 },
@@ -387,7 +455,7 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
                                 command,
                                 "result:",
                                 result,
-                                "runtime: %.1fs" % runtime,
+                                f"runtime: {runtime:.1f}s",
                             )
                             working_set.discard(job.job_id)
                     except Exception as e:
@@ -406,23 +474,20 @@ def worker(n, cmd_server_pool, gitjobdir, args, working_set):
 
 
 class SyncSet(object):
+    # set.add() and set.discard() of a single object are atomic under the
+    # GIL, as is swapping the set in empty(), so no explicit lock is needed.
     def __init__(self):
         self.set = set()
-        self.lock = threading.Lock()
 
     def add(self, obj):
-        with self.lock:
-            self.set.add(obj)
+        self.set.add(obj)
 
     def discard(self, obj):
-        with self.lock:
-            self.set.discard(obj)
+        self.set.discard(obj)
 
     def empty(self):
-        with self.lock:
-            oldset = self.set
-            self.set = set()
-            return oldset
+        oldset, self.set = self.set, set()
+        return oldset
 
 
 verbose = 0
@@ -469,7 +534,7 @@ def handle_control_job(args, job):
             vprint(1, "dwqw: ping received")
             result = "pong"
         else:
-            vprint(1, 'dwqw: unknown control command "%s" received' % cmd)
+            vprint(1, f'dwqw: unknown control command "{cmd}" received')
 
     except KeyError:
         vprint(1, "dwqw: error: invalid control job")
@@ -488,15 +553,17 @@ def main():
     global shutdown
     global verbose
     global active_event
+    global base_env
 
     args = parse_args()
     verbose = args.verbose - args.quiet
+    base_env = dict(os.environ)
 
     cmd_server_pool = cmdserver.CmdServerPool(args.jobs)
 
     signal.signal(signal.SIGTERM, sigterm_handler)
 
-    _dir = "/tmp/dwq.%s" % str(random.random())
+    _dir = f"/tmp/dwq.{util.unique_id()}"
     gitjobdir = GitJobDir(_dir, args.jobs)
 
     servers = [args.disque_url]
@@ -528,9 +595,13 @@ def main():
                     time.sleep(1)
                     continue
 
+                # wake up workers waiting for the connection
+                with connected_cond:
+                    connected_cond.notify_all()
+
             try:
-                control_jobs = Job.get(["control::worker::%s" % args.name])
-                for job in control_jobs or []:
+                control_jobs = Job.get([f"control::worker::{args.name}"])
+                for job in control_jobs or ():
                     handle_control_job(args, job)
             except RedisError:
                 pass
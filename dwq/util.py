@@ -1,5 +1,6 @@
 import json
 import base64
+import itertools
 import os
 
 
@@ -7,6 +8,22 @@ class GenFileDataException(Exception):
     pass
 
 
+# job result status values that count as "passed"
+PASS_STATUSES = frozenset({0, "0", "pass"})
+
+# empty dict, default for optional body fields. never modify this!
+EMPTY_DICT = {}
+
+_unique_nonce = os.urandom(6).hex()
+_unique_counter = itertools.count()
+
+
+def unique_id():
+    # unique per process (random nonce) and per call (counter).
+    # next() on itertools.count() is atomic under the GIL.
+    return f"{_unique_nonce}-{next(_unique_counter)}"
+
+
 def gen_file_data(names, root=None):
     res = {}
     if not root:
@@ -28,8 +45,15 @@ def base64_file(name):
         return base64.b64encode(f.read()).decode("ascii")
 
 
+def json_default(obj):
+    # job ids are passed around as bytes
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "backslashreplace")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 def write_files(data, workdir=None):
-    data = data or {}
+    data = data or EMPTY_DICT
     for filename, filedata in data.items():
         if workdir:
             filename = os.path.join(workdir, filename)